@@ -50,7 +50,14 @@ def generate_from_prompt(
     steps: int,
     device: Any,
     return_on_eos: bool,
-):
+    eos_check_interval: int = 16,
+) -> torch.Tensor:
+    """
+    Generates up to `steps` tokens from a prompt and returns them as a (1, n) tensor.
+
+    To avoid a device -> host sync every step, we only check for an EOS token every
+    `eos_check_interval` steps and truncate the output at the first EOS token.
+    """
 
     tokens = torch.tensor(
         tokenizer.encode(prompt.strip()),
@@ -58,61 +65,71 @@ def generate_from_prompt(
     )
 
     x = tokens.view(1, -1).to(device)
+    prompt_len = x.shape[1]
     if x.shape[1] > model.num_ctx:
         x_cond = x[:, -model.num_ctx :]
     else:
         x_cond = x
 
+    # preallocate the full output so each step writes one token instead of copying the history
+    x_buf = torch.empty((1, prompt_len + steps), dtype=torch.long, device=device)
+    x_buf[:, :prompt_len] = x
+    cur_pos = prompt_len
+
     layer_past = None
-    generated_tokens = []
+    # mask of previously generated tokens, kept on device for the repetition penalty
+    seen_tokens = torch.zeros(model.vocab_size, dtype=torch.bool, device=device)
+    hit_eos = torch.zeros((), dtype=torch.bool, device=device)
 
-    for _ in tqdm(range(steps), disable=True):
+    for step in tqdm(range(steps), disable=True):
         with torch.cuda.amp.autocast(cache_enabled=False):
             logits, layer_past = model(x_cond, use_cache=True, past_states=layer_past)
 
-        logits = logit_processor(logits, generated_tokens)
+        logits = logit_processor(logits, seen_tokens)
         logits = sampling_func(logits)
         probs = F.softmax(logits, dim=-1)
 
         if sample:
             x_cond = torch.multinomial(probs, num_samples=1)
-            if return_on_eos:
-                if x_cond.item() == tokenizer.eos_token_id:
-                    return x
-
-            x = torch.cat((x[:, :], x_cond), axis=1)
-
-            if x_cond.item() not in generated_tokens:
-                generated_tokens.append(x_cond.item())
+            seen_tokens[x_cond.view(-1)] = True
         else:
             x_cond = torch.topk(probs, k=1).indices
-            if return_on_eos:
-                if x_cond.item() == tokenizer.eos_token_id:
-                    return x
-            x = torch.cat((x[:, :], x_cond), axis=1)
 
-        yield x_cond
+        # the k/v cache holds the history, only the newest token is fed to the model
+        x_buf[:, cur_pos] = x_cond.view(-1)
+        cur_pos += 1
+
+        if return_on_eos:
+            hit_eos |= (x_cond == tokenizer.eos_token_id).any()
+            if (step + 1) % eos_check_interval == 0 and hit_eos:
+                break
+
+    generated = x_buf[:, prompt_len:cur_pos]
+
+    if return_on_eos:
+        eos_idx = (generated[0] == tokenizer.eos_token_id).nonzero()
+        if eos_idx.numel() > 0:
+            generated = generated[:, : eos_idx[0, 0]]
+
+    return generated
 
 
 def process_logits(
-    logits: torch.tensor, generated_tokens: list, rep_pen: float, temperature: float
+    logits: torch.tensor, seen_tokens: torch.tensor, rep_pen: float, temperature: float
 ) -> torch.tensor:
     logits = logits[:, -1, :] / temperature
 
-    for prev_gen_token in generated_tokens:
-        if logits[:, prev_gen_token] < 0:
-            logits[:, prev_gen_token] *= rep_pen
-        else:
-            logits[:, prev_gen_token] /= rep_pen
+    # apply the penalty to all previously generated tokens at once
+    penalized_logits = torch.where(logits < 0, logits * rep_pen, logits / rep_pen)
+    logits = torch.where(seen_tokens, penalized_logits, logits)
 
     return logits
 
 
 def top_k_logits(logits: torch.Tensor, k: int) -> torch.Tensor:
-    v, ix = torch.topk(logits, k)
-    out = logits.clone()
-    out[out < v[:, [-1]]] = -float("Inf")
-    return out
+    """Filter a distribution of logits to the top k tokens. Modifies logits in place."""
+    thresh = torch.topk(logits, k).values[:, -1:]
+    return logits.masked_fill_(logits < thresh, -float("Inf"))
 
 
 def top_p_logits(
@@ -129,16 +146,18 @@ def top_p_logits(
 
     if top_p > 0.0:
         sorted_logits, sorted_indices = torch.sort(logits, descending=True)
-        cumulative_probs = torch.cumsum(F.softmax(sorted_logits, dim=-1), dim=-1)
+        sorted_probs = F.softmax(sorted_logits, dim=-1)
+        cumulative_probs = torch.cumsum(sorted_probs, dim=-1)
 
-        # Remove tokens with cumulative probability above the threshold
-        sorted_indices_to_remove = cumulative_probs > top_p
-        # Shift the indices to the right to keep also the first token above the threshold
-        sorted_indices_to_remove[..., 1:] = sorted_indices_to_remove[..., :-1].clone()
-        sorted_indices_to_remove[..., 0] = 0
+        # Remove tokens with cumulative probability above the threshold, excluding
+        # their own mass keeps the first token above the threshold
+        sorted_indices_to_remove = (cumulative_probs - sorted_probs) > top_p
 
-        indices_to_remove = sorted_indices[sorted_indices_to_remove]
-        logits[:, indices_to_remove] = filter_value
+        # Scatter back to vocab order and mask in place, avoiding a boolean index (and sync)
+        indices_to_remove = sorted_indices_to_remove.scatter(
+            -1, sorted_indices, sorted_indices_to_remove
+        )
+        logits.masked_fill_(indices_to_remove, filter_value)
     return logits
 
 
@@ -165,7 +184,7 @@ def generate_text(
         process_logits, rep_pen=repetition_penalty, temperature=temperature
     )
 
-    text_generator = generate_from_prompt(
+    generated = generate_from_prompt(
         prompt,
         model,
         tokenizer,
@@ -177,11 +196,7 @@ def generate_text(
         return_on_eos=eos_return,
     )
 
-    text = []
-    for token in text_generator:
-        text.append(tokenizer.decode(token.tolist()[0]))
-
-    generated_text = "".join(text)
+    generated_text = tokenizer.decode(generated[0].tolist())
 
     return [
         (prompt, None),
@@ -26,12 +26,15 @@ from src.models.GPT import model_getter
 from src.partitioning.partition import create_opt_spec, set_partitions_zero
 from src.partitioning.xmap_train_functions import (
     eval_step,
+    reduce_scatter_out_axes,
     train_step,
+    unstack_grads,
     update_opt_state,
 )
 from src.training.training_utils import compute_tokens_seen, initialized
 from src.utils.configs import flatten_dict
 from src.utils.dataloader import numpy_collate
+from src.utils.fuse_qkv import fuse_qkv_params
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
@@ -99,7 +102,8 @@ def restore_param_checkpoint(workdir: str) -> Any:
     """
     params = checkpoints.restore_checkpoint(workdir, target=None, prefix="params_")
 
-    return flax.core.freeze(params["params"])
+    # checkpoints saved before qkv fusion have separate q/k/v projections
+    return flax.core.freeze(fuse_qkv_params(params["params"]))
 
 
 def restore_opt_checkpoint(workdir: str) -> Tuple[Any, int]:
@@ -113,11 +117,13 @@ def restore_opt_checkpoint(workdir: str) -> Tuple[Any, int]:
     )
 
     mu_pytree = jax.tree_util.tree_map(
-        lambda x: jnp.array(x), opt_state_restored["opt_state"]["1"]["0"]["mu"]
+        lambda x: jnp.array(x),
+        fuse_qkv_params(opt_state_restored["opt_state"]["1"]["0"]["mu"]),
     )
 
     nu_pytree = jax.tree_util.tree_map(
-        lambda x: jnp.array(x), opt_state_restored["opt_state"]["1"]["0"]["nu"]
+        lambda x: jnp.array(x),
+        fuse_qkv_params(opt_state_restored["opt_state"]["1"]["0"]["nu"]),
     )
 
     count_pytree = jax.tree_util.tree_map(
@@ -201,7 +207,7 @@ def main():
         raise NotImplementedError("Training not currently supported on GPU.")
 
     model, model_config = model_getter(
-        cfg.model.size, config_path=args.model_cfg, return_cfg=True, dtype=jnp.float32
+        cfg.model.size, config_path=args.model_cfg, return_cfg=True, dtype=jnp.bfloat16
     )
 
     learning_rate_fn = optax.warmup_cosine_decay_schedule(
@@ -230,12 +236,20 @@ def main():
     # axis_list_params = jax.tree_map(lambda x: [...], params)
     axis_list_params = [...]
 
+    grad_param_spec = set_partitions_zero(param_shape)
+
+    # grads are reduce-scattered in train_step, each device returns the shard
+    # matching grad_param_spec, stacked along the sharded dimension
+    axis_list_grads = reduce_scatter_out_axes(grad_param_spec)
+
+    # batches are laid out as (grad_accum, devices, local_batch, ctx)
     in_axes = (
         axis_list_params,
-        ["batch", ...],
+        {1: "batch"},
+        [...],
         [...],
     )
-    out_axes = (axis_list_params, [...])
+    out_axes = (axis_list_grads, [...])
 
     # standard data parallel training step with xmap!
     train_step_xmap = xmap(
@@ -243,6 +257,8 @@ def main():
             train_step,
             model=model,
             accum_steps=cfg.training.gradient_accumulation_steps,
+            vmap_accum=cfg.training.get("vmap_gradient_accumulation", False),
+            grad_spec=grad_param_spec,
         ),
         in_axes=in_axes,
         out_axes=out_axes,
@@ -262,7 +278,6 @@ def main():
 
     opt_state_shapes = jax.eval_shape(tx.init, params)
 
-    grad_param_spec = set_partitions_zero(param_shape)
     opt_state_spec = create_opt_spec(grad_param_spec, opt_state_shapes)
 
     if (cfg.model.warm_init) and not (args.resume):
@@ -429,8 +444,6 @@ def main():
 
     accum_steps = cfg.training.gradient_accumulation_steps
 
-    rng = jax.random.fold_in(rng, resume_step)  # fold in resume step to create new rng
-
     # quick way to track global step count when resuming a run
     new_steps = 0
 
@@ -459,6 +472,12 @@ def main():
             lambda x: x, in_axis_resources=None, out_axis_resources=grad_param_spec
         )
 
+        # merge the stacked per-device grad shards back into the param shapes
+        grad_unstack = pjit(
+            partial(unstack_grads, param_shape=param_shape),
+            out_axis_resources=grad_param_spec,
+        )
+
         for i, text in enumerate(tqdm(tl, disable=not jax.process_index() == 0)):
 
             if (resume_step + new_steps) > cfg.training.total_steps:
@@ -470,31 +489,25 @@ def main():
             if i < iterator_resume_step:
                 continue
 
-            rng, dropout_rng = jax.random.split(rng, 2)
-
             gradient_accumulation_steps = accum_steps
 
             if seq_len < cfg.data.max_context:
                 text = text.reshape(-1, seq_len)
 
-            # we add a 'grad_accum' batch dimension which we then iterate through in train_step
+            # we add a leading 'grad_accum' batch dimension which we then iterate through in train_step
             text = text.reshape(
                 gradient_accumulation_steps,
-                text.shape[0] // gradient_accumulation_steps,
-                seq_len,
-            ).transpose(1, 0, 2)
-            text = text.reshape(
                 jax.device_count(),
                 cfg.training.batch_size
                 * (cfg.data.max_context // cfg.training.train_context)
                 // (jax.device_count() * gradient_accumulation_steps),
-                gradient_accumulation_steps,
                 seq_len,
-            )  # (8, 4, 2, 2048) -> (32, 1, 2, 2048)
+            )  # (8, 2048) -> (2, 4, 1, 2048)
 
-            grads, metrics = train_step_xmap(params, text, dropout_rng)
+            # dropout keys are derived from rng and the absolute step inside train_step
+            grads, metrics = train_step_xmap(params, text, rng, resume_step + new_steps)
 
-            grads = grad_shard(grads)
+            grads = grad_unstack(grads)
             params = grad_shard(params)
 
             params, opt_state = update_opt_state_pjit(grads, opt_state, params)
@@ -23,6 +23,8 @@ class TransformerBlock(nn.Module):
     N: int = None
     dtype: Any = jnp.float32
     alibi_attn: bool = True
+    fused_attn: bool = False
+    scale_by_head_dim: bool = False
 
     @nn.compact
     def __call__(
@@ -39,6 +41,8 @@ class TransformerBlock(nn.Module):
             self.N,
             self.alibi_attn,
             self.dtype,
+            self.fused_attn,
+            self.scale_by_head_dim,
         )(nn.LayerNorm(dtype=self.dtype, use_bias=False)(x), train)
         x = x + attn_out
         x = x + MLPBlock(
@@ -63,6 +67,8 @@ class Transformer(nn.Module):
     N: int = None
     dtype: Any = jnp.float32
     alibi_attn: bool = False
+    fused_attn: bool = False
+    scale_by_head_dim: bool = False
 
     @nn.compact
     def __call__(
@@ -93,11 +99,14 @@ class Transformer(nn.Module):
                 self.N,
                 self.dtype,
                 self.alibi_attn,
+                self.fused_attn,
+                self.scale_by_head_dim,
             )(out, train)
 
         out = nn.LayerNorm(dtype=self.dtype, use_bias=False)(out)
 
-        logits = embed.attend(out)
+        # unembedding in fp32, bf16 logits lose too much precision in the softmax
+        logits = jnp.dot(out.astype(jnp.float32), embed.embedding.T)
 
         if labels is None:
             return logits
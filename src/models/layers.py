@@ -1,6 +1,6 @@
 import math
-from functools import partial
-from typing import Any, List
+from functools import lru_cache, partial
+from typing import Any, Tuple
 
 import flax.linen as nn
 import jax
@@ -14,12 +14,15 @@ def shard_noop(x, spec):
     return nn_partitioning.with_sharding_constraint(x, spec)
 
 
-def get_slopes(n: int) -> List:
-    def get_slopes_power_of_2(n):
-        start = 2 ** (-(2 ** -(math.log2(n) - 3)))
-        ratio = start
-        return [start * ratio**i for i in range(n)]
+@lru_cache(maxsize=None)
+def get_slopes_power_of_2(n: int) -> Tuple:
+    start = 2 ** (-(2 ** -(math.log2(n) - 3)))
+    ratio = start
+    return tuple(start * ratio**i for i in range(n))
 
+
+@lru_cache(maxsize=None)
+def get_slopes(n: int) -> Tuple:
     if math.log2(n).is_integer():
         return get_slopes_power_of_2(n)
     else:
@@ -30,22 +33,11 @@ def get_slopes(n: int) -> List:
         )
 
 
-def create_mask(seq_len_k, slopes):
-
-    a = -jnp.tril(
-        jnp.tile(jnp.arange(seq_len_k).reshape(seq_len_k, 1), (1, seq_len_k))
-        + jnp.arange(0, -seq_len_k, step=-1)
-    )
-
-    a = a * (slopes.reshape(slopes.shape[0], 1, 1))
-
-    alibi_mask = a[:, seq_len_k - 1, :].reshape(a.shape[0], 1, a.shape[2])
-
-    return alibi_mask
-
-
 class MLPBlock(nn.Module):
-    """Standard MLP Block"""
+    """Standard MLP Block
+
+    Computation is done in `dtype` while parameters are kept in fp32
+    """
 
     embedding_dim: int
     dimension_multiplier: int = 4
@@ -63,6 +55,7 @@ class MLPBlock(nn.Module):
             kernel_init=initializers.normal(stddev=0.02),
             bias_init=initializers.zeros,
             dtype=self.dtype,
+            param_dtype=jnp.float32,
             use_bias=False,
         )(x)
         x = nn.gelu(x)
@@ -72,6 +65,7 @@ class MLPBlock(nn.Module):
             kernel_init=initializers.normal(stddev=(0.02 / jnp.sqrt(2 * self.N))),
             bias_init=initializers.zeros,
             dtype=self.dtype,
+            param_dtype=jnp.float32,
             use_bias=False,
         )(x)
         return dropout()(out)
@@ -84,6 +78,13 @@ class CausalAttention(nn.Module):
     - ALiBi attention biasing from
     `Train Short, Test Long: Attention with Linear Biases Enables Input
     Length Extrapolation <https://ofir.io/train_short_test_long.pdf>`
+    - Mixed precision, computation is done in `dtype` while parameters are kept
+    in fp32 and the softmax is computed in fp32
+    - Fused (flash) attention through `jax.nn.dot_product_attention`. Requires
+    JAX >= 0.4.31, so this is disabled by default
+    - `scale_by_head_dim` scales the attention scores by sqrt(head_dim) as in
+    the original transformer. Disabled by default since existing checkpoints
+    were trained with scores scaled by sqrt of the key length
 
     """
 
@@ -94,11 +95,28 @@ class CausalAttention(nn.Module):
     N: int = None
     alibi_attn: bool = False
     dtype: Any = jnp.float32
+    fused_attn: bool = False
+    scale_by_head_dim: bool = False
 
     def setup(self):
+        if self.fused_attn and not hasattr(jax.nn, "dot_product_attention"):
+            raise NotImplementedError(
+                "fused_attn requires jax.nn.dot_product_attention (JAX >= 0.4.31), "
+                f"found JAX {jax.__version__}"
+            )
+
         self.slopes = jnp.array(get_slopes(self.num_head))
 
-        self.alibi_mask = create_mask(self.block_size, self.slopes)
+        # ALiBi bias of shape (1, nh, 1, block_size), the distance of every key from
+        # the final query. Softmax is invariant to the per-query offset this introduces
+        pos = jnp.arange(self.block_size)
+        self.alibi_bias = (pos - (self.block_size - 1))[
+            None, None, None, :
+        ] * self.slopes[None, :, None, None]
+
+        self.causal_mask = jnp.tril(
+            jnp.ones((self.block_size, self.block_size), dtype=jnp.bool_)
+        )[None, None]
 
     @nn.compact
     def __call__(
@@ -109,74 +127,64 @@ class CausalAttention(nn.Module):
         dropout = partial(nn.Dropout, rate=self.dropout, deterministic=not train)
         T, C = x.shape[-2:]
 
-        key = (
-            nn.Dense(
-                name="key_proj",
-                features=self.embedding_dim,
-                kernel_init=initializers.normal(stddev=0.02),
-                bias_init=initializers.zeros,
-                dtype=self.dtype,
-                use_bias=False,
-            )(x)
-        )
-
-        value = (
-            nn.Dense(
-                name="value_proj",
-                features=self.embedding_dim,
-                kernel_init=initializers.normal(stddev=0.02),
-                bias_init=initializers.zeros,
-                dtype=self.dtype,
-                use_bias=False,
-            )(x)
-        )
-
-        query = (
-            nn.Dense(
-                name="query_proj",
-                features=self.embedding_dim,
-                kernel_init=initializers.normal(stddev=0.02),
-                bias_init=initializers.zeros,
-                dtype=self.dtype,
-                use_bias=False,
-            )(x)
-        )
-
-        key = rearrange(
-            key, "b t (nh hd) -> b t nh hd", nh=self.num_head, hd=self.embedding_dim // self.num_head
-        )
-        query = rearrange(
-            query, "b t (nh hd) -> b t nh hd", nh=self.num_head, hd=self.embedding_dim // self.num_head
-        )
-        value = rearrange(
-            value, "b t (nh hd) -> b t nh hd", nh=self.num_head, hd=self.embedding_dim // self.num_head
-        )
-
-        key = rearrange(key, "b t n c -> b n c t")
-        value = rearrange(value, "b t n c -> b n t c")
-        query = rearrange(query, "b t n c -> b n t c")
-
-        attn_full = (query @ key) / jnp.sqrt(
-            key.shape[-1]
-        ) 
-
-        if self.alibi_attn:
-            # NOTE: We are fixing the ALiBi mask since this is for training, during inference or is seq_len changes this will cause issues
-            attn_full = attn_full + self.alibi_mask[:, :T, :T]
-
-        mask = jnp.tril(jnp.ones((T, T), dtype=jnp.int8)).reshape(1, 1, T, T)
+        qkv = nn.Dense(
+            name="qkv_proj",
+            features=3 * self.embedding_dim,
+            kernel_init=initializers.normal(stddev=0.02),
+            bias_init=initializers.zeros,
+            dtype=self.dtype,
+            param_dtype=jnp.float32,
+            use_bias=False,
+        )(x)
 
-        masked_attn = jnp.where(
-            mask, attn_full.astype(jnp.float32), jnp.finfo(jnp.float32).min
+        qkv = rearrange(
+            qkv,
+            "b t (three nh hd) -> three b t nh hd",
+            three=3,
+            nh=self.num_head,
+            hd=self.embedding_dim // self.num_head,
         )
-
-        attn_scores = nn.softmax(masked_attn, axis=-1)
-        attn_scores = dropout()(attn_scores)
-        attn_out = (attn_scores @ value)
-        attn_out = rearrange(attn_out, "b n t h -> b t n h")
+        query, key, value = qkv[0], qkv[1], qkv[2]
+
+        scale_dim = self.embedding_dim // self.num_head if self.scale_by_head_dim else T
+
+        if self.fused_attn:
+            # NOTE: The fused kernel never materializes the attention scores,
+            # so dropout is only applied on the residual branch
+            attn_out = jax.nn.dot_product_attention(
+                query,
+                key,
+                value,
+                # bias is kept in fp32, its magnitude is too large for bf16
+                bias=self.alibi_bias[..., -T:] if self.alibi_attn else None,
+                scale=1.0 / math.sqrt(scale_dim),
+                is_causal=True,
+            )
+
+        else:
+            key = rearrange(key, "b t n c -> b n c t")
+            value = rearrange(value, "b t n c -> b n t c")
+            query = rearrange(query, "b t n c -> b n t c")
+
+            attn_full = (query @ key) / jnp.sqrt(scale_dim)
+
+            if self.alibi_attn:
+                attn_full = attn_full + self.alibi_bias[..., -T:]
+
+            masked_attn = jnp.where(
+                self.causal_mask[..., :T, :T],
+                attn_full.astype(jnp.float32),
+                jnp.finfo(jnp.float32).min,
+            )
+
+            # softmax in fp32, then back to the compute dtype for the value matmul
+            attn_scores = nn.softmax(masked_attn, axis=-1).astype(value.dtype)
+            attn_scores = dropout()(attn_scores)
+            attn_out = attn_scores @ value
+            attn_out = rearrange(attn_out, "b n t h -> b t n h")
 
         attn_out = rearrange(attn_out, "b t n h -> b t (n h)")
-        
+
         out = nn.Dense(
             name="residual_out",
             features=self.embedding_dim,
@@ -185,6 +193,7 @@ class CausalAttention(nn.Module):
             ),
             bias_init=initializers.zeros,
             dtype=self.dtype,
+            param_dtype=jnp.float32,
             use_bias=False,
         )(attn_out)
 
@@ -59,9 +59,9 @@ def _get_partition_rules_zero():
         (("wte", "embedding"), PartitionSpec("dp", None)),
         (("wpe", "embedding"), PartitionSpec("dp", None)),
         # attention
-        (("(query_proj|key_proj|value_proj)", "kernel"), PartitionSpec(None, "dp")),
+        (("qkv_proj", "kernel"), PartitionSpec(None, "dp")),
         (("residual_out", "kernel"), PartitionSpec("dp", None)),
-        (("(query_proj|key_proj|value_proj)", "bias"), PartitionSpec("dp")),
+        (("qkv_proj", "bias"), PartitionSpec("dp")),
         (("residual_out", "bias"), PartitionSpec("dp")),
         # MLP
         (("fc_in", "kernel"), PartitionSpec(None, "dp")),
@@ -8,6 +8,7 @@ import jax
 import jax.numpy as jnp
 import optax
 from jax.lax import with_sharding_constraint
+from jax.sharding import PartitionSpec
 
 
 def to_bf16(t):
@@ -22,66 +23,135 @@ def to_f32(t):
     )
 
 
+def reduce_scatter_grads(grads: Any, grad_spec: Any, axis_name: str = "batch"):
+    """
+    Reduce-scatters grads across devices so each device only receives the shard of the
+    mean gradient along the dimension partitioned over 'dp' in grad_spec
+    """
+    num_devices = jax.lax.psum(1, axis_name=axis_name)
+
+    def scatter(spec, grad):
+        return (
+            jax.lax.psum_scatter(
+                grad,
+                axis_name=axis_name,
+                scatter_dimension=spec.index("dp"),
+                tiled=True,
+            )
+            / num_devices
+        )
+
+    return jax.tree_util.tree_map(
+        scatter, grad_spec, grads, is_leaf=lambda x: isinstance(x, PartitionSpec)
+    )
+
+
+def reduce_scatter_out_axes(grad_spec: Any, axis_name: str = "batch"):
+    """
+    xmap out_axes for the output of reduce_scatter_grads. Each device's shard is
+    stacked along the dimension partitioned over 'dp' in grad_spec
+    """
+    return jax.tree_util.tree_map(
+        lambda spec: {spec.index("dp"): axis_name},
+        grad_spec,
+        is_leaf=lambda x: isinstance(x, PartitionSpec),
+    )
+
+
+def unstack_grads(grads: Any, param_shape: Any):
+    """
+    Merges the stacked per-device grad shards returned by xmap back into the
+    param shapes
+    """
+    return jax.tree_util.tree_map(lambda g, p: g.reshape(p.shape), grads, param_shape)
+
+
 # we xmap this
 def train_step(
     params: Any,
     batch: jnp.array,
     rng_key: jax.random.PRNGKey = None,
+    step: int = 0,
     accum_steps: int = 8,
     model: Any = None,
+    vmap_accum: bool = False,
+    grad_spec: Any = None,
 ):
     """
     Computes loss/grads for a single batch of data, pmeans across all devices/hosts to sync grads
-    and returns loss/grads
+    and returns loss/grads. Expects batch to have shape (accum_steps, local_batch, ctx)
+
+    Gradients are accumulated with a rematerialized lax.scan over the minibatches unless
+    vmap_accum is set, in which case all minibatches are vmapped over at once (faster for
+    small models, but holds every minibatch's activations and gradients in memory)
+
+    If grad_spec is given, grads are reduce-scattered to match it instead of all-reduced,
+    so each device only returns its own shard
+
+    Dropout keys are derived on device by folding the step and minibatch index into rng_key
     """
 
-    def get_minibatch(batch, grad_idx):
-        return jax.tree_util.tree_map(
-            lambda x: jax.lax.dynamic_index_in_dim(x, grad_idx, keepdims=False, axis=1),
-            batch,
-        )
+    rng_key = jax.random.fold_in(rng_key, step)
 
-    def loss_fn(params, batch):
+    def loss_fn(params, batch, dropout_rng):
         _, loss = model.apply(
             {"params": params["params"]},
             x=batch,
             labels=batch,
             train=True,
-            rngs={"dropout": rng_key},
+            rngs={"dropout": dropout_rng},
         )
         return loss
 
+    if not vmap_accum:
+        # only save matmul outputs for the backward pass, everything else is recomputed
+        loss_fn = jax.checkpoint(
+            loss_fn,
+            prevent_cse=False,
+            policy=jax.checkpoint_policies.dots_with_no_batch_dims_saveable,
+        )
+
     grad_fn = jax.value_and_grad(loss_fn, has_aux=False)
 
-    def loss_and_grad(grad_idx):
-        minibatch = get_minibatch(batch, grad_idx) if grad_idx is not None else batch
-        loss, grads = grad_fn(to_bf16(params), minibatch)
+    def loss_and_grad(grad_idx, minibatch):
+        dropout_rng = jax.random.fold_in(rng_key, grad_idx)
+        loss, grads = grad_fn(to_bf16(params), minibatch, dropout_rng)
 
         return loss, grads
 
-    init_minibatch = (0.0, to_bf16(jax.tree_util.tree_map(jnp.zeros_like, params)))
+    if vmap_accum:
+        # accumulate gradients, vmapping over the 'grad_accum' axis lets XLA batch the
+        # minibatches together instead of running them sequentially
+        loss, grads = jax.vmap(loss_and_grad, in_axes=0)(jnp.arange(accum_steps), batch)
+
+        loss, grads = jax.tree_util.tree_map(lambda x: x.mean(0), (loss, grads))
 
-    # accumulate gradients
-    def cumul_minibatch_step(grad_idx, cumul_loss_grad):
-        cumul_loss, cumul_grads = cumul_loss_grad
-        loss, grads = loss_and_grad(grad_idx)
-        cumul_loss, cumul_grads = jax.tree_util.tree_map(
-            jnp.add, (cumul_loss, cumul_grads), (loss, grads)
+    else:
+        init_minibatch = (
+            jnp.zeros((), dtype=jnp.float32),
+            to_bf16(jax.tree_util.tree_map(jnp.zeros_like, params)),
         )
 
-        return cumul_loss, cumul_grads
+        # accumulate gradients
+        def cumul_minibatch_step(cumul_loss_grad, idx_minibatch):
+            loss, grads = loss_and_grad(*idx_minibatch)
+            cumul_loss_grad = jax.tree_util.tree_map(
+                jnp.add, cumul_loss_grad, (loss, grads)
+            )
 
-    loss, grads = jax.lax.fori_loop(
-        0,
-        accum_steps,
-        cumul_minibatch_step,
-        init_minibatch,
-    )
+            return cumul_loss_grad, None
+
+        (loss, grads), _ = jax.lax.scan(
+            cumul_minibatch_step, init_minibatch, (jnp.arange(accum_steps), batch)
+        )
 
-    loss, grads = jax.tree_util.tree_map(lambda x: x / accum_steps, (loss, grads))
+        loss, grads = jax.tree_util.tree_map(lambda x: x / accum_steps, (loss, grads))
 
     loss = jax.lax.pmean(loss, axis_name="batch")
-    grads = jax.lax.pmean(grads, axis_name="batch")
+    if grad_spec is not None:
+        grads = reduce_scatter_grads(grads, grad_spec, axis_name="batch")
+    else:
+        grads = jax.lax.pmean(grads, axis_name="batch")
 
     metrics = {
         "train/loss": loss,
@@ -112,11 +182,11 @@ def update_opt_state(
 ):
     """
     Updates the sharded optimizer state and parameters. Expects grads, optimizer_state, and params
-    to have the same partition specs
+    to have the same partition specs. grads are expected to already be sharded from the
+    reduce-scatter in train_step
     """
 
     params = with_sharding_constraint(params, grad_spec)
-    grads = with_sharding_constraint(grads, grad_spec)
     updates, new_opt_state = optimizer.update(grads, optimizer_state, params)
     new_params = optax.apply_updates(params, updates)
 
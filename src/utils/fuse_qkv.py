@@ -0,0 +1,33 @@
+"""
+Utility function to remap params from checkpoints trained with separate
+query/key/value projections to the fused qkv projection used in CausalAttention
+"""
+import numpy as np
+
+
+def fuse_qkv_params(params_pytree):
+    """
+    Stacks the old query_proj, key_proj and value_proj params of every
+    attention layer along axis 1 into a single qkv_proj
+    """
+
+    for key in list(params_pytree["params"].keys()):
+        if "TransformerBlock" in key:
+            attn = params_pytree["params"][key]["CausalAttention_0"]
+
+            if "qkv_proj" in attn:
+                continue
+
+            projections = [
+                attn.pop(f"{name}_proj") for name in ["query", "key", "value"]
+            ]
+
+            attn["qkv_proj"] = {
+                param_name: np.concatenate(
+                    [np.asarray(proj[param_name]) for proj in projections],
+                    axis=-1,
+                )
+                for param_name in projections[0].keys()
+            }
+
+    return params_pytree
@@ -45,6 +45,23 @@ class TestMLP(unittest.TestCase):
             (out.shape, out_nodrop.shape), (batch_cts.shape, batch_cts.shape)
         )
 
+    def test_MLP_bf16_params(self):
+        mlp = MLPBlock(
+            embedding_dim=128, dimension_multiplier=4, N=6, dtype=jnp.bfloat16
+        )
+        batch_cts = random.normal(self.rng, shape=(1, 512, 128))
+        params = mlp.init(self.init_rng, batch_cts, False)
+
+        out = mlp.apply({"params": params["params"]}, batch_cts, train=False)
+
+        self.assertEqual(out.dtype, jnp.bfloat16)
+        self.assertTrue(
+            all(
+                p.dtype == jnp.float32
+                for p in jax.tree_util.tree_leaves(params["params"])
+            )
+        )
+
 
 class TestAttn(unittest.TestCase):
     def setUp(self) -> None:
@@ -115,6 +132,117 @@ class TestAttn(unittest.TestCase):
             (out.shape, out_nodrop.shape), (batch_cts.shape, batch_cts.shape)
         )
 
+    def test_attn_bf16(self):
+        attn = CausalAttention(
+            embedding_dim=128,
+            num_head=8,
+            block_size=512,
+            N=6,
+            alibi_attn=True,
+        )
+        attn_bf16 = CausalAttention(
+            embedding_dim=128,
+            num_head=8,
+            block_size=512,
+            N=6,
+            alibi_attn=True,
+            dtype=jnp.bfloat16,
+        )
+        batch_cts = random.normal(self.rng, shape=(1, 512, 128))
+        params = attn.init(self.init_rng, batch_cts, False)
+
+        out = attn.apply({"params": params["params"]}, batch_cts, train=False)
+        out_bf16 = attn_bf16.apply({"params": params["params"]}, batch_cts, train=False)
+
+        self.assertEqual(out_bf16.dtype, jnp.bfloat16)
+        self.assertTrue(jnp.allclose(out, out_bf16.astype(jnp.float32), atol=1e-2))
+
+    def test_attn_scale_by_head_dim(self):
+        attn = CausalAttention(
+            embedding_dim=128,
+            num_head=8,
+            block_size=512,
+            N=6,
+            alibi_attn=True,
+        )
+        attn_head_dim = CausalAttention(
+            embedding_dim=128,
+            num_head=8,
+            block_size=512,
+            N=6,
+            alibi_attn=True,
+            scale_by_head_dim=True,
+        )
+
+        # head_dim is 16, so the two scalings only agree on 16 token sequences
+        batch_cts = random.normal(self.rng, shape=(1, 16, 128))
+        params = attn.init(self.init_rng, batch_cts, False)
+        out = attn.apply({"params": params["params"]}, batch_cts, train=False)
+        out_head_dim = attn_head_dim.apply(
+            {"params": params["params"]}, batch_cts, train=False
+        )
+        self.assertTrue(jnp.allclose(out, out_head_dim, atol=1e-6))
+
+        batch_cts = random.normal(self.rng, shape=(1, 512, 128))
+        out = attn.apply({"params": params["params"]}, batch_cts, train=False)
+        out_head_dim = attn_head_dim.apply(
+            {"params": params["params"]}, batch_cts, train=False
+        )
+        self.assertFalse(jnp.allclose(out, out_head_dim, atol=1e-6))
+
+    @unittest.skipUnless(
+        hasattr(jax.nn, "dot_product_attention"),
+        "jax.nn.dot_product_attention not available",
+    )
+    def test_attn_fused_matches(self):
+        attn = CausalAttention(
+            embedding_dim=128,
+            num_head=8,
+            block_size=512,
+            dropout=0.1,
+            N=6,
+            alibi_attn=True,
+        )
+        batch_cts = random.normal(self.rng, shape=(1, 512, 128))
+        params = attn.init(self.init_rng, batch_cts, False)
+
+        out = attn.apply({"params": params["params"]}, batch_cts, train=False)
+
+        for dtype, atol in [(jnp.float32, 1e-5), (jnp.bfloat16, 1e-2)]:
+            with self.subTest(dtype=dtype):
+                attn_fused = CausalAttention(
+                    embedding_dim=128,
+                    num_head=8,
+                    block_size=512,
+                    dropout=0.1,
+                    N=6,
+                    alibi_attn=True,
+                    dtype=dtype,
+                    fused_attn=True,
+                )
+                out_fused = attn_fused.apply(
+                    {"params": params["params"]}, batch_cts, train=False
+                )
+                self.assertTrue(
+                    jnp.allclose(out, out_fused.astype(jnp.float32), atol=atol)
+                )
+
+    @unittest.skipIf(
+        hasattr(jax.nn, "dot_product_attention"),
+        "jax.nn.dot_product_attention is available",
+    )
+    def test_attn_fused_unavailable(self):
+        attn = CausalAttention(
+            embedding_dim=128,
+            num_head=8,
+            block_size=512,
+            N=6,
+            fused_attn=True,
+        )
+        batch_cts = random.normal(self.rng, shape=(1, 512, 128))
+        with self.assertRaises(NotImplementedError):
+            attn.init(self.init_rng, batch_cts, False)
+
 
 class TestTransformerBlock(unittest.TestCase):
     def setUp(self) -> None:
@@ -229,6 +357,31 @@ class TestGPT(unittest.TestCase):
         )
         self.assertEqual((1, self.block_size, self.vocab_size), out.shape)
 
+    def test_gpt_fwd_bf16(self):
+
+        block = Transformer(
+            embedding_dim=128,
+            vocab_size=self.vocab_size,
+            num_head=8,
+            block_size=512,
+            dropout=0.1,
+            N=6,
+            dtype=jnp.bfloat16,
+            alibi_attn=True,
+        )
+        batch_tok = random.randint(self.rng, shape=(1, 512), maxval=256, minval=0)
+        params = block.init(self.init_rng, batch_tok, None, False)
+
+        out = block.apply(
+            {"params": params["params"]},
+            batch_tok,
+            train=True,
+            rngs={"dropout": self.rng},
+        )
+        self.assertEqual((1, self.block_size, self.vocab_size), out.shape)
+        # logits are computed in fp32 regardless of the compute dtype
+        self.assertEqual(out.dtype, jnp.float32)
+
     def test_gpt_loss_standard(self):
 
         block = Transformer(
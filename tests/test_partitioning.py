@@ -0,0 +1,60 @@
+"""
+Tests for the ZeRO gradient reduce-scatter, run on 4 fake CPU devices
+"""
+
+import os
+
+# must be set before the jax backend is initialized
+os.environ["XLA_FLAGS"] = (
+    os.environ.get("XLA_FLAGS", "") + " --xla_force_host_platform_device_count=4"
+)
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+import pytest
+from jax.experimental.maps import xmap
+from jax.sharding import Mesh, PartitionSpec
+
+from src.partitioning.xmap_train_functions import (
+    reduce_scatter_grads,
+    reduce_scatter_out_axes,
+    unstack_grads,
+)
+
+NUM_DEVICES = 4
+
+
+@pytest.mark.skipif(
+    jax.device_count() < NUM_DEVICES,
+    reason="jax backend was initialized before XLA_FLAGS could be set",
+)
+@pytest.mark.parametrize(
+    "shape, spec",
+    [
+        ((8, 12), PartitionSpec("dp", None)),
+        ((12, 8), PartitionSpec(None, "dp")),
+        ((16,), PartitionSpec("dp")),
+    ],
+)
+def test_reduce_scatter_grads(shape, spec):
+    rng = np.random.default_rng(0)
+    device_grads = {"w": rng.normal(size=(NUM_DEVICES, *shape)).astype(np.float32)}
+    grad_spec = {"w": spec}
+    param_shape = {"w": jax.ShapeDtypeStruct(shape, jnp.float32)}
+
+    mesh = Mesh(np.asarray(jax.devices()[:NUM_DEVICES]), ("dp",))
+    scatter_xmap = xmap(
+        lambda grads: reduce_scatter_grads(grads, grad_spec),
+        in_axes=({"w": {0: "batch"}},),
+        out_axes=reduce_scatter_out_axes(grad_spec),
+        axis_resources={"batch": "dp"},
+    )
+
+    with mesh:
+        grads = scatter_xmap(device_grads)
+
+    grads = unstack_grads(grads, param_shape)
+
+    assert grads["w"].shape == shape
+    assert np.allclose(grads["w"], device_grads["w"].mean(0), atol=1e-6)
@@ -3,8 +3,10 @@ Tests for any extra utility functions
 """
 
 import jax.numpy as jnp
+import numpy as np
 import pytest
 
+from src.utils.fuse_qkv import fuse_qkv_params
 from src.utils.losses import cross_entropy_loss
 
 
@@ -55,3 +57,28 @@ def test_loss_expected(labels, logits, expected):
     out = cross_entropy_loss(labels, logits)
 
     assert jnp.allclose(out, expected)
+
+
+def test_fuse_qkv_params():
+    """
+    Ensure old-style separate q/k/v params are remapped to
+    the fused qkv projection
+    """
+    embedding_dim = 64
+    rng = np.random.default_rng(0)
+    old_attn = {
+        f"{name}_proj": {"kernel": rng.normal(size=(embedding_dim, embedding_dim))}
+        for name in ["query", "key", "value"]
+    }
+    params = {"params": {"TransformerBlock_0": {"CausalAttention_0": old_attn}}}
+
+    expected = np.concatenate(
+        [old_attn[f"{name}_proj"]["kernel"] for name in ["query", "key", "value"]],
+        axis=1,
+    )
+
+    out = fuse_qkv_params(params)
+    fused_attn = out["params"]["TransformerBlock_0"]["CausalAttention_0"]
+
+    assert list(fused_attn.keys()) == ["qkv_proj"]
+    assert np.allclose(fused_attn["qkv_proj"]["kernel"], expected)
@@ -117,6 +117,7 @@ class ALiBi(nn.Module):
 
         self.n_head = num_head
         self.num_layers = num_layers
+        self.block_size = block_size
 
         self.register_buffer("slopes", torch.Tensor(self.get_slopes(self.n_head)))
         self.register_buffer(
@@ -153,8 +154,13 @@ class ALiBi(nn.Module):
         self,
         x: torch.Tensor,
         use_cache: bool = False,
-        layer_past: Tuple[torch.Tensor, torch.Tensor] = None,
-    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        layer_past: Tuple[torch.Tensor, int] = None,
+    ) -> Tuple[torch.Tensor, Tuple[torch.Tensor, int]]:
+        """
+        When using the k/v cache, layer_past is a tuple of a preallocated
+        (2, B, nh, capacity, hd) buffer of stacked keys/values and the number of
+        positions filled in it. New keys/values are written into the buffer in place.
+        """
         B, T, C = x.size()
 
         k,q,v = self.key(x), self.query(x), self.value(x)
@@ -175,11 +181,36 @@ class ALiBi(nn.Module):
         present = None
         if use_cache:
             if layer_past is not None:
-                past_keys, past_values = layer_past
-                k = torch.cat((past_keys, k), dim=-2)
-                v = torch.cat((past_values, v), dim=-2)
+                kv_cache, cache_len = layer_past
+            else:
+                kv_cache = k.new_empty(
+                    (2, B, self.n_head, self.block_size, C // self.n_head)
+                )
+                cache_len = 0
+
+            new_len = cache_len + T
+            capacity = kv_cache.shape[-2]
+            if new_len > capacity:
+                # past the preallocated context, grow the buffer geometrically
+                kv_cache = torch.cat(
+                    (
+                        kv_cache,
+                        kv_cache.new_empty(
+                            kv_cache.shape[:-2]
+                            + (
+                                max(new_len, 2 * capacity) - capacity,
+                                kv_cache.shape[-1],
+                            )
+                        ),
+                    ),
+                    dim=-2,
+                )
+
+            kv_cache[0, :, :, cache_len:new_len] = k
+            kv_cache[1, :, :, cache_len:new_len] = v
+            k, v = kv_cache[0, :, :, :new_len], kv_cache[1, :, :, :new_len]
 
-            present = torch.stack((k, v))
+            present = (kv_cache, new_len)
 
         # Need to grab these
         seq_len_k, seq_len_q = k.size(-2), q.size(-2)
@@ -284,8 +315,8 @@ class GPT2Block(nn.Module):
         self,
         x: torch.Tensor,
         use_cache: bool = False,
-        layer_past: Tuple[torch.Tensor, torch.Tensor] = None,
-    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        layer_past: Tuple[torch.Tensor, int] = None,
+    ) -> Tuple[torch.Tensor, Tuple[torch.Tensor, int]]:
 
         attn_out = self.attn(self.ln1(x), use_cache, layer_past)
         x = x + attn_out[0]
@@ -5,6 +5,11 @@ make it a bit easier to push to HF Hub if I want to do that.
 """
 
 import argparse
+import os
+import sys
+
+# flax_to_pytorch imports from src/, make the repo root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from flax_to_pytorch import match_and_save
 from GPT2 import model_getter
@@ -2,15 +2,22 @@ import numpy as np
 import torch
 from flax.serialization import msgpack_restore
 
+from src.utils.fuse_qkv import fuse_qkv_params
+
 
 def create_transformer_block_mapping(block_idx: int, use_bias: bool = False):
     """
     Creates required flax -> PyTorch mapping for a specific transformer block
+
+    The fused flax qkv projection maps to a tuple of the (query, key, value)
+    PyTorch parameters, in the order they are stacked in the fused kernel.
     """
     dict_params = {
-        "CausalAttention_0.key_proj.kernel": f"blocks.{block_idx}.attn.key.weight",
-        "CausalAttention_0.value_proj.kernel": f"blocks.{block_idx}.attn.value.weight",
-        "CausalAttention_0.query_proj.kernel": f"blocks.{block_idx}.attn.query.weight",
+        "CausalAttention_0.qkv_proj.kernel": (
+            f"blocks.{block_idx}.attn.query.weight",
+            f"blocks.{block_idx}.attn.key.weight",
+            f"blocks.{block_idx}.attn.value.weight",
+        ),
         "CausalAttention_0.residual_out.kernel": f"blocks.{block_idx}.attn.fc_resid.weight",
         "MLPBlock_0.fc_in.kernel": f"blocks.{block_idx}.mlp.fc1.weight",
         "MLPBlock_0.fc_residual.kernel": f"blocks.{block_idx}.mlp.fc_resid.weight",
@@ -22,9 +29,11 @@ def create_transformer_block_mapping(block_idx: int, use_bias: bool = False):
         bias_dict = {
             "CausalAttention_0.residual_out.bias": f"blocks.{block_idx}.attn.fc_resid.bias",
             "MLPBlock_0.fc_residual.bias": f"blocks.{block_idx}.mlp.fc_resid.bias",
-            "CausalAttention_0.key_proj.bias": f"blocks.{block_idx}.attn.key.bias",
-            "CausalAttention_0.value_proj.bias": f"blocks.{block_idx}.attn.value.bias",
-            "CausalAttention_0.query_proj.bias": f"blocks.{block_idx}.attn.query.bias",
+            "CausalAttention_0.qkv_proj.bias": (
+                f"blocks.{block_idx}.attn.query.bias",
+                f"blocks.{block_idx}.attn.key.bias",
+                f"blocks.{block_idx}.attn.value.bias",
+            ),
             "LayerNorm_0.bias": f"blocks.{block_idx}.ln1.bias",
             "LayerNorm_1.bias": f"blocks.{block_idx}.ln2.bias",
             "MLPBlock_0.fc_in.bias": f"blocks.{block_idx}.mlp.fc1.bias",
@@ -59,6 +68,18 @@ def match_transformer_block(pytree, state_dict, block_idx, use_bias):
 
         pytorch_block_key = block_mappings[key]
 
+        if isinstance(pytorch_block_key, tuple):
+            # Fused qkv projection, split back into separate q/k/v params
+            for pytorch_key, split_value in zip(
+                pytorch_block_key, np.split(np.array(value), 3, axis=-1)
+            ):
+                if split_value.ndim > 1:
+                    split_value = np.transpose(split_value, (1, 0))
+                state_dict[pytorch_key] = torch.from_numpy(
+                    np.ascontiguousarray(split_value)
+                )
+            continue
+
         if value.ndim > 1:
             # Not an LN or bias parameter, tranpose the weight
             value = np.transpose(value, (1, 0))
@@ -88,6 +109,9 @@ def match_and_save(
     with open(flax_save_path, "rb") as f:
         pytree = msgpack_restore(f.read())
 
+    # checkpoints saved before the qkv projections were fused
+    pytree = fuse_qkv_params(pytree)
+
     state_dict = model.state_dict()
 
     for block_idx in range(model.N):
@@ -61,11 +61,54 @@ def test_match_conversion(test_jax_model):
 
         for key, value in block_mapping_dict.items():
             jax_pytree_val = np.array(flattened_block[key])
-            torch_param_val = torch_model.state_dict()[value].detach().numpy()
 
-            if jax_pytree_val.ndim > 1:
-                assert np.allclose(
-                    np.transpose(jax_pytree_val, (1, 0)), torch_param_val
-                )
+            if isinstance(value, tuple):
+                # fused qkv kernel is split into separate q/k/v weights
+                jax_pytree_vals = np.split(jax_pytree_val, 3, axis=-1)
             else:
-                assert np.allclose(jax_pytree_val, torch_param_val)
+                jax_pytree_vals, value = [jax_pytree_val], (value,)
+
+            for jax_pytree_val, torch_key in zip(jax_pytree_vals, value):
+                torch_param_val = torch_model.state_dict()[torch_key].detach().numpy()
+
+                if jax_pytree_val.ndim > 1:
+                    assert np.allclose(
+                        np.transpose(jax_pytree_val, (1, 0)), torch_param_val
+                    )
+                else:
+                    assert np.allclose(jax_pytree_val, torch_param_val)
+
+
+def test_match_conversion_unfused_qkv(test_jax_model, tmp_path):
+    # checkpoints saved before the qkv fusion have separate q/k/v projections
+    with open(test_jax_model, "rb") as f:
+        jax_pytree = msgpack_restore(f.read())
+
+    for key, block in jax_pytree["params"].items():
+        if "TransformerBlock" in key:
+            attn = block["CausalAttention_0"]
+            qkv_kernel = np.split(attn.pop("qkv_proj")["kernel"], 3, axis=-1)
+            for name, kernel in zip(["query", "key", "value"], qkv_kernel):
+                attn[f"{name}_proj"] = {"kernel": kernel}
+
+    unfused_path = str(tmp_path / "test_unfused.msgpack")
+    with open(unfused_path, "wb") as f:
+        f.write(msgpack_serialize(jax_pytree))
+
+    torch_model = torch_model_getter("test")
+    match_and_save(torch_model, unfused_path, str(tmp_path / "test_unfused.pth"))
+
+    for block_idx in range(torch_model.N):
+        attn = jax_pytree["params"][f"TransformerBlock_{block_idx}"][
+            "CausalAttention_0"
+        ]
+        for name in ["query", "key", "value"]:
+            torch_param_val = (
+                torch_model.state_dict()[f"blocks.{block_idx}.attn.{name}.weight"]
+                .detach()
+                .numpy()
+            )
+            assert np.allclose(
+                np.transpose(attn[f"{name}_proj"]["kernel"], (1, 0)),
+                torch_param_val,
+            )
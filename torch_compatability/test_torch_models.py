@@ -51,7 +51,7 @@ def test_alibi_attn_cache(model_config):
     v_prev = torch.rand(
         (1, cfg["n_head"], cache_size, cfg["embed_dim"] // cfg["n_head"])
     )
-    layer_past = torch.stack((k_prev, v_prev))
+    layer_past = (torch.stack((k_prev, v_prev)), cache_size)
 
     layer = ALiBi(
         embedding_dim=cfg["embed_dim"],
@@ -72,22 +72,17 @@ def test_alibi_attn_cache(model_config):
 
     present_cache_again = out_again[1]
 
-    assert (out[0].shape, present_cache.shape, present_cache_again.shape) == (
+    assert (out[0].shape, present_cache[1], present_cache_again[1]) == (
         batch.shape,
-        (
-            2,
-            1,
-            cfg["n_head"],
-            cache_size + 1,
-            cfg["embed_dim"] // cfg["n_head"],
-        ),
-        (
-            2,
-            1,
-            cfg["n_head"],
-            cache_size + 2,
-            cfg["embed_dim"] // cfg["n_head"],
-        ),
+        cache_size + 1,
+        cache_size + 2,
+    )
+    assert present_cache_again[0][:, :, :, : present_cache_again[1]].shape == (
+        2,
+        1,
+        cfg["n_head"],
+        cache_size + 2,
+        cfg["embed_dim"] // cfg["n_head"],
     )
 
 
@@ -128,7 +123,7 @@ def test_transformerblock_cache(model_config):
     v_prev = torch.rand(
         (1, cfg["n_head"], cache_size, cfg["embed_dim"] // cfg["n_head"])
     )
-    layer_past = torch.stack((k_prev, v_prev))
+    layer_past = (torch.stack((k_prev, v_prev)), cache_size)
 
     batch = torch.rand((1, 1, cfg["embed_dim"]))
     out = layer(batch, use_cache=True, layer_past=layer_past)
@@ -141,22 +136,17 @@ def test_transformerblock_cache(model_config):
 
     present_cache_again = out[1]
 
-    assert (out[0].shape, present_cache.shape, present_cache_again.shape) == (
+    assert (out[0].shape, present_cache[1], present_cache_again[1]) == (
         batch.shape,
-        (
-            2,
-            1,
-            cfg["n_head"],
-            cache_size + 1,
-            cfg["embed_dim"] // cfg["n_head"],
-        ),
-        (
-            2,
-            1,
-            cfg["n_head"],
-            cache_size + 2,
-            cfg["embed_dim"] // cfg["n_head"],
-        ),
+        cache_size + 1,
+        cache_size + 2,
+    )
+    assert present_cache_again[0][:, :, :, : present_cache_again[1]].shape == (
+        2,
+        1,
+        cfg["n_head"],
+        cache_size + 2,
+        cfg["embed_dim"] // cfg["n_head"],
     )
 
 
@@ -176,6 +166,33 @@ def test_gpt2_no_labels(model_config):
     assert out.shape == batch.shape + (cfg["vocab_size"],)
 
 
+def test_gpt2_cache_matches(model_config):
+    # Ensure decoding with the k/v cache matches a full forward pass
+    cfg = model_config
+    model = GPT2(
+        embedding_dim=cfg["embed_dim"],
+        num_head=cfg["n_head"],
+        num_ctx=cfg["ctx"],
+        vocab_size=cfg["vocab_size"],
+        N=cfg["n_layer"],
+    )
+    model.eval()
+
+    batch = torch.randint(0, cfg["vocab_size"], (1, cfg["ctx"]))
+    with torch.no_grad():
+        logits_full = model(batch)
+
+        past_states = None
+        logits_cached = []
+        for i in range(cfg["ctx"]):
+            logits, past_states = model(
+                batch[:, i : i + 1], use_cache=True, past_states=past_states
+            )
+            logits_cached.append(logits)
+
+    assert torch.allclose(logits_full, torch.cat(logits_cached, dim=1), atol=1e-5)
+
+
 def test_gpt2_labels(model_config):
     cfg = model_config
     model = GPT2(